@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import logging
+import argparse
+
+import ultimateAgent
+from ultimateAgent import UltimateAgent, UltimateState
+
+
+# Random games tried per requested position before giving up
+MAX_ATTEMPTS = 1000
+
+
+def random_positions(count, plies, seed):
+    """Random but still running positions reached after a number of plies."""
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(count * MAX_ATTEMPTS):
+        if len(positions) == count:
+            break
+        state = UltimateState()
+        for _ in range(plies):
+            if state.winner is not None:
+                break
+            state.play(rng.choice(list(state.legal_moves())))
+        if state.winner is None:
+            positions.append(state)
+    if len(positions) < count:
+        raise ValueError(f'only {len(positions)} of {count} random games were still running after {plies} plies')
+    return positions
+
+
+def bench_movegen(positions, repeat):
+    """Times legal move generation plus play/undo of every legal move."""
+    moves = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for state in positions:
+            for move in state.legal_moves():
+                state.play(move)
+                state.undo()
+                moves += 1
+    elapsed = time.perf_counter() - start
+    return moves, elapsed
+
+
+def bench_search(positions, budget):
+    """Runs the engine on every position with a fixed time budget per move."""
+    agent = UltimateAgent()
+    nodes = 0
+    depths = []
+    start = time.perf_counter()
+    for state in positions:
+        _, _, report = agent.chooseAction(state, time.monotonic() + budget)
+        nodes += agent.nodes
+        depths.append(report[-1]['depth'] if report else 0)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed, depths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ultimate tic-tac-toe engine benchmark')
+    parser.add_argument('--positions', type=int, default=20, help='number of random positions')
+    parser.add_argument('--plies', type=int, default=10, help='random plies played to reach each position')
+    parser.add_argument('--budget', type=float, default=0.5, help='search time per position (seconds)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    args = parser.parse_args()
+    if args.positions < 1:
+        parser.error('--positions must be at least 1')
+    # Every game is over once all 81 cells are taken
+    if not 0 <= args.plies < 81:
+        parser.error('--plies must be between 0 and 80')
+    if args.budget <= 0:
+        parser.error('--budget must be positive')
+
+    # The per-iteration search report is too verbose here
+    ultimateAgent.logger.setLevel(logging.WARNING)
+
+    try:
+        positions = random_positions(args.positions, args.plies, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    moves, elapsed = bench_movegen(positions, 100)
+    print(f'Move generation: {moves} moves in {elapsed:.3f}s ({moves / elapsed:.0f} moves/s)')
+
+    nodes, elapsed, depths = bench_search(positions, args.budget)
+    print(f'Search: {nodes} nodes in {elapsed:.3f}s ({nodes / elapsed:.0f} nodes/s)')
+    print(f'Completed depth: min {min(depths)}, avg {sum(depths) / len(depths):.1f}, max {max(depths)}')
+
+
+if __name__ == '__main__':
+    main()
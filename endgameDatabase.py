@@ -0,0 +1,101 @@
+import math
+import mmap
+import struct
+from itertools import combinations
+
+
+# Results are stored from the point of view of the side to move, two bits each
+DRAW, WIN, LOSS = 0, 1, 2
+RESULT_NAMES = {DRAW: 'draw', WIN: 'win', LOSS: 'loss'}
+
+# File header: magic, rows, cols, k
+HEADER = struct.Struct('<8sBBB')
+MAGIC = b'TTTEGDB1'
+
+
+def layerOffsets(n):
+    """File offset of each layer; layer sizes only depend on the number of cells."""
+    offsets = []
+    offset = HEADER.size
+    for p in range(n + 1):
+        offsets.append(offset)
+        offset += (math.comb(n, p) * math.comb(p, (p + 1) // 2) + 3) // 4
+    offsets.append(offset)
+    return offsets
+
+
+class LayerIndex:
+    """Compact index of the positions with p pieces on n cells.
+
+    x always moves first, so x owns (p + 1) // 2 of the pieces. A position is
+    ranked by its set of occupied cells among all p-subsets of the board, then by
+    which of those p pieces belong to x (a mask over the occupied cells in order).
+    """
+
+    def __init__(self, n, p):
+        self.n = n
+        self.p = p
+        self.nx = (p + 1) // 2
+        self.occupied = [sum(1 << c for c in cells) for cells in combinations(range(n), p)]
+        self.occupied_rank = {mask: i for i, mask in enumerate(self.occupied)}
+        self.x_masks = [sum(1 << j for j in picks) for picks in combinations(range(p), self.nx)]
+        self.x_rank = {mask: i for i, mask in enumerate(self.x_masks)}
+        self.size = len(self.occupied) * len(self.x_masks)
+        self.nbytes = (self.size + 3) // 4
+
+    def index(self, occupied, x_board):
+        # Compress the x pieces to a mask over the occupied cells
+        x_mask = 0
+        j = 0
+        rest = occupied
+        while rest:
+            low = rest & -rest
+            if x_board & low:
+                x_mask |= 1 << j
+            rest ^= low
+            j += 1
+        return self.occupied_rank[occupied] * len(self.x_masks) + self.x_rank[x_mask]
+
+
+class EndgameDatabase:
+    """Read-only access to a database written by endgameGenerator, memory-mapped from disk."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.rows, self.cols, self.k = HEADER.unpack_from(self._data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not an endgame database')
+        self._offsets = layerOffsets(self.rows * self.cols)
+        self._layers = {}
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def lookup(self, board, symbol):
+        """Result (WIN, DRAW or LOSS) for symbol to move on board, None if the database does not cover it.
+
+        The board uses the agent's encoding: 1 for x, -1 for o and 0 for empty cells.
+        """
+        if len(board) != self.rows or any(len(row) != self.cols for row in board):
+            return None
+
+        x_board = o_board = 0
+        for r in range(self.rows):
+            for c in range(self.cols):
+                if board[r][c] == 1:
+                    x_board |= 1 << (r * self.cols + c)
+                elif board[r][c] == -1:
+                    o_board |= 1 << (r * self.cols + c)
+
+        occupied = x_board | o_board
+        p = bin(occupied).count('1')
+        if bin(x_board).count('1') != (p + 1) // 2 or symbol != (1 if p % 2 == 0 else -1):
+            return None
+
+        if p not in self._layers:
+            self._layers[p] = LayerIndex(self.rows * self.cols, p)
+        i = self._layers[p].index(occupied, x_board)
+        return self._data[self._offsets[p] + (i >> 2)] >> ((i & 3) << 1) & 3
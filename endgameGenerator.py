@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import time
+import logging
+import argparse
+from itertools import combinations
+
+from endgameDatabase import DRAW, WIN, LOSS, RESULT_NAMES, HEADER, MAGIC, LayerIndex, layerOffsets
+
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Solved positions are flushed to disk in chunks of this many bytes (4 positions per byte)
+CHUNK_SIZE = 1 << 16
+
+
+def _lines(rows, cols, k):
+    """Bit masks of every k-in-a-row segment (cell r, c is bit r * cols + c)."""
+    lines = []
+    for r in range(rows):
+        for c in range(cols):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_r, end_c = r + dr * (k - 1), c + dc * (k - 1)
+                if 0 <= end_r < rows and 0 <= end_c < cols:
+                    lines.append(sum(1 << ((r + dr * i) * cols + c + dc * i) for i in range(k)))
+    return lines
+
+
+def _winTable(n, lines):
+    """table[mask] is 1 when the cells in mask contain a complete line."""
+    by_cell = [[line for line in lines if line >> cell & 1] for cell in range(n)]
+    table = bytearray(1 << n)
+    for mask in range(1, 1 << n):
+        # A mask wins if it did without its lowest cell or through a line using that cell
+        low = mask & -mask
+        table[mask] = table[mask ^ low] or any(mask & line == line for line in by_cell[low.bit_length() - 1])
+    return table
+
+
+def _solveLayer(layer, child, data, child_offset, win_table, out):
+    """Solves every position of layer and appends it to out, chunk by chunk.
+
+    The layer with one more piece (child, None for a full board) is read back
+    from data, the memory-mapped database file, starting at child_offset.
+    """
+    n, p = layer.n, layer.p
+    chunk = bytearray(CHUNK_SIZE)
+    chunk_positions = CHUNK_SIZE * 4
+    counts = [0, 0, 0]
+    # x moves when both sides have the same number of pieces
+    x_to_move = p % 2 == 0
+    new_bit = 1 if x_to_move else 0
+    child_x_rank = child.x_rank if child is not None else None
+
+    i = 0
+    for occupied in layer.occupied:
+        cells = [1 << c for c in range(n) if occupied >> c & 1]
+        # For every empty cell: rank of the grown occupied set and where the new piece lands in it
+        moves = []
+        if child is not None:
+            for e in range(n):
+                if not occupied >> e & 1:
+                    j = bin(occupied & ((1 << e) - 1)).count('1')
+                    base = child.occupied_rank[occupied | 1 << e] * len(child.x_masks)
+                    moves.append((base, j, (1 << j) - 1))
+
+        for x_mask, picks in zip(layer.x_masks, combinations(cells, layer.nx)):
+            x_board = sum(picks)
+            last_board = occupied ^ x_board if x_to_move else x_board
+
+            if win_table[last_board]:
+                # The previous move completed a line
+                result = LOSS
+            elif not moves:
+                result = DRAW
+            else:
+                result = LOSS
+                for base, j, low_bits in moves:
+                    low = x_mask & low_bits
+                    grown = ((x_mask ^ low) << 1) | low | (new_bit << j)
+                    ci = base + child_x_rank[grown]
+                    child_result = data[child_offset + (ci >> 2)] >> ((ci & 3) << 1) & 3
+                    if child_result == LOSS:
+                        result = WIN
+                        break
+                    if child_result == DRAW:
+                        result = DRAW
+
+            if result:
+                chunk[i >> 2] |= result << ((i & 3) << 1)
+            counts[result] += 1
+            i += 1
+            if i == chunk_positions:
+                out.write(chunk)
+                chunk = bytearray(CHUNK_SIZE)
+                i = 0
+
+    out.write(chunk[:(i + 3) // 4])
+    return counts
+
+
+def build(path, rows=3, cols=3, k=3):
+    """Solves the rows x cols k-in-a-row game by retrograde analysis and writes it to path.
+
+    Positions are solved layer by layer, from the full board down to the empty
+    one. Results are flushed to the file every CHUNK_SIZE bytes and the layer
+    above is read back through mmap, so the process only holds the rank tables
+    of two layers and one chunk; the OS page cache backs the rest.
+    """
+    n = rows * cols
+    start = time.monotonic()
+    win_table = _winTable(n, _lines(rows, cols, k))
+    offsets = layerOffsets(n)
+
+    counts = [0, 0, 0]
+    child = None
+    with open(path, 'w+b') as f:
+        f.write(HEADER.pack(MAGIC, rows, cols, k))
+        f.truncate(offsets[-1])
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for p in range(n, -1, -1):
+                layer = LayerIndex(n, p)
+                f.seek(offsets[p])
+                layer_counts = _solveLayer(layer, child, data, offsets[p + 1], win_table, f)
+                # Make the layer visible through the mapping before it is read back
+                f.flush()
+                counts = [a + b for a, b in zip(counts, layer_counts)]
+                logger.info(f'Layer {p}: {layer.size} positions ({time.monotonic() - start:.1f}s)')
+                child = layer
+            result = data[offsets[0]] & 3
+
+    return {'positions': sum(counts), 'wins': counts[WIN], 'draws': counts[DRAW], 'losses': counts[LOSS],
+            'result': RESULT_NAMES[result], 'time': time.monotonic() - start,
+            'size': os.path.getsize(path)}
+
+
+def _peakMemory():
+    """Peak resident set size of the process in MiB, None where it cannot be measured."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retrograde endgame database generator for k-in-a-row games')
+    parser.add_argument('--rows', type=int, default=3, help='board rows')
+    parser.add_argument('--cols', type=int, default=3, help='board columns')
+    parser.add_argument('-k', type=int, default=3, help='pieces in a row needed to win')
+    parser.add_argument('--output', help='database file (default: endgame_<rows>x<cols>_<k>.db)')
+    args = parser.parse_args()
+
+    path = args.output or f'endgame_{args.rows}x{args.cols}_{args.k}.db'
+
+    stats = build(path, args.rows, args.cols, args.k)
+    peak = _peakMemory()
+
+    print(f'Positions: {stats["positions"]} ({stats["wins"]} wins, {stats["draws"]} draws, '
+          f'{stats["losses"]} losses for the side to move)')
+    print(f'Empty board: {stats["result"]} for x')
+    print(f'Build time: {stats["time"]:.2f}s')
+    print(f'Memory peak: {"unavailable" if peak is None else f"{peak:.1f} MiB"}')
+    print(f'Database size: {stats["size"]} bytes ({path})')
+
+
+if __name__ == '__main__':
+    main()
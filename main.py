@@ -13,6 +13,8 @@ import logging
 
 
 from minMaxAgent import MinMaxAgent
+from endgameDatabase import EndgameDatabase
+from ultimateAgent import UltimateAgent, UltimateState
 
 
 # --- Setup Logger ---
@@ -31,13 +33,26 @@ COLOR_INACTIVE = pg.Color('lightskyblue3')
 COLOR_ACTIVE = pg.Color('dodgerblue2')
 LINE_COLOR_X = (233, 65, 65)
 LINE_COLOR_O = (0, 134, 244)
+HIGHLIGHT = (255, 245, 200)
 FPS = 30
+BOT_TIME_BUDGET = 0.25  # seconds the bot may think per move
+BOT_DIFFICULTY = 'hard'
 
 def find_assets_path():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(script_dir, 'assets')
 
 ASSETS_PATH = find_assets_path()
+# Optional endgame database for the classic board, see endgameGenerator.py
+ENDGAME_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'endgame_3x3_3.db')
+
+def ultimate_move(row, col):
+    """Converts a cell of the 9x9 ultimate grid into an engine move (board * 9 + cell)."""
+    return (row // 3 * 3 + col // 3) * 9 + row % 3 * 3 + col % 3
+
+def ultimate_cell(board, cell):
+    """Converts an engine (board, cell) pair into a (row, col) of the 9x9 ultimate grid."""
+    return board // 3 * 3 + cell // 3, board % 3 * 3 + cell % 3
 
 class Game:
     def __init__(self):
@@ -45,17 +60,23 @@ class Game:
         self.screen = pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT + 100), 0, 32)
         pg.display.set_caption("Tic Tac Toe (Asyncio)")
         self.clock = pg.time.Clock()
-        self.bot = MinMaxAgent()
+        db = EndgameDatabase(ENDGAME_DB_PATH) if os.path.exists(ENDGAME_DB_PATH) else None
+        self.bot = MinMaxAgent(db=db)
+        self.ultimate_bot = UltimateAgent()
         self.mapping = {'x': 1, None: 0, 'o': -1}
         
         self.game_state = "MAIN_MENU" 
         self.game_mode = None
+        self.variant = "classic"
         
-        self.board = [[None] * 3, [None] * 3, [None] * 3]
+        self.state = None
+        self.board = self.new_board()
         self.turn = 'x'
         self.winner = None
         self.draw = False
         self.scores = {'x': 0, 'o': 0, 'draws': 0}
+        self.bot_thinking = False
+        self.bot_task = None
         
         self.reader = None
         self.writer = None
@@ -70,6 +91,7 @@ class Game:
         self.local_play_rect = pg.Rect(100, 150, 200, 50)
         self.remote_host_rect = pg.Rect(100, 220, 200, 50)
         self.remote_join_rect = pg.Rect(100, 290, 200, 50)
+        self.variant_rect = pg.Rect(100, 360, 200, 50)
 
         self.input_box = pg.Rect(50, 200, 300, 32)
         self.input_text = ''
@@ -86,6 +108,10 @@ class Game:
             self.one_player_img = pg.image.load(os.path.join(ASSETS_PATH, 'one_player.png'))
             self.two_players_img = pg.image.load(os.path.join(ASSETS_PATH, 'two_players.png'))
 
+            self.x_small_img = pg.transform.scale(self.x_img, (34, 34))
+            self.o_small_img = pg.transform.scale(self.o_img, (34, 34))
+            self.x_large_img = pg.transform.scale(self.x_img, (110, 110))
+            self.o_large_img = pg.transform.scale(self.o_img, (110, 110))
             self.x_img = pg.transform.scale(self.x_img, (80, 80))
             self.o_img = pg.transform.scale(self.o_img, (80, 80))
             self.one_player_img = pg.transform.scale(self.one_player_img, (200, 102))
@@ -106,14 +132,17 @@ class Game:
         pg.draw.rect(self.screen, GRAY, self.local_play_rect)
         pg.draw.rect(self.screen, GRAY, self.remote_host_rect)
         pg.draw.rect(self.screen, GRAY, self.remote_join_rect)
+        pg.draw.rect(self.screen, GRAY, self.variant_rect)
 
         local_text = self.font_medium.render("Local Play", True, BLACK)
         host_text = self.font_medium.render("Host Game", True, BLACK)
         join_text = self.font_medium.render("Join Game", True, BLACK)
+        variant_text = self.font_medium.render(f"Mode: {self.variant.title()}", True, BLACK)
         
         self.screen.blit(local_text, (self.local_play_rect.centerx - local_text.get_width() / 2, self.local_play_rect.centery - local_text.get_height() / 2))
         self.screen.blit(host_text, (self.remote_host_rect.centerx - host_text.get_width() / 2, self.remote_host_rect.centery - host_text.get_height() / 2))
         self.screen.blit(join_text, (self.remote_join_rect.centerx - join_text.get_width() / 2, self.remote_join_rect.centery - join_text.get_height() / 2))
+        self.screen.blit(variant_text, (self.variant_rect.centerx - variant_text.get_width() / 2, self.variant_rect.centery - variant_text.get_height() / 2))
 
     def draw_local_menu(self):
         self.screen.fill(WHITE)
@@ -140,7 +169,21 @@ class Game:
         text_rect = text_surface.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
         self.screen.blit(text_surface, text_rect)
 
+    def new_board(self):
+        # A fresh board always starts a fresh match, x to move
+        self.turn = 'x'
+        self.winner = None
+        self.draw = False
+        if self.variant == "ultimate":
+            self.state = UltimateState()
+            return [[None] * 9 for _ in range(9)]
+        self.state = None
+        return [[None] * 3, [None] * 3, [None] * 3]
+
     def draw_board(self):
+        if self.variant == "ultimate":
+            self.draw_ultimate_board()
+            return
         self.screen.fill(WHITE)
         pg.draw.line(self.screen, BLACK, (SCREEN_WIDTH / 3, 0), (SCREEN_WIDTH / 3, SCREEN_HEIGHT), 7)
         pg.draw.line(self.screen, BLACK, (SCREEN_WIDTH / 3 * 2, 0), (SCREEN_WIDTH / 3 * 2, SCREEN_HEIGHT), 7)
@@ -148,6 +191,36 @@ class Game:
         pg.draw.line(self.screen, BLACK, (0, SCREEN_HEIGHT / 3 * 2), (SCREEN_WIDTH, SCREEN_HEIGHT / 3 * 2), 7)
         self.draw_status()
     
+    def draw_ultimate_board(self):
+        self.screen.fill(WHITE)
+        cell_w = SCREEN_WIDTH / 9
+        cell_h = SCREEN_HEIGHT / 9
+
+        # Highlight the sub-boards the next move may be played in
+        for b in {move // 9 for move in self.state.legal_moves()}:
+            pg.draw.rect(self.screen, HIGHLIGHT, ((b % 3) * cell_w * 3, (b // 3) * cell_h * 3, cell_w * 3, cell_h * 3))
+
+        for i in range(1, 9):
+            width = 5 if i % 3 == 0 else 1
+            pg.draw.line(self.screen, BLACK, (i * cell_w, 0), (i * cell_w, SCREEN_HEIGHT), width)
+            pg.draw.line(self.screen, BLACK, (0, i * cell_h), (SCREEN_WIDTH, i * cell_h), width)
+
+        for row in range(9):
+            for col in range(9):
+                if self.board[row][col] is not None:
+                    img = self.x_small_img if self.board[row][col] == 'x' else self.o_small_img
+                    self.screen.blit(img, (col * cell_w + 5, row * cell_h + 5))
+
+        # Cover won sub-boards with the winner's mark
+        for p, img in enumerate((self.x_large_img, self.o_large_img)):
+            for b in range(9):
+                if self.state.macro[p] >> b & 1:
+                    rect = pg.Rect((b % 3) * cell_w * 3 + 3, (b // 3) * cell_h * 3 + 3, cell_w * 3 - 6, cell_h * 3 - 6)
+                    self.screen.fill(WHITE, rect)
+                    self.screen.blit(img, img.get_rect(center=rect.center))
+
+        self.draw_status()
+
     def draw_status(self):
         total_games = self.scores['x'] + self.scores['o'] + self.scores['draws']
         score_text = (f"Win X: {self.scores['x']}/{total_games} | "
@@ -178,6 +251,10 @@ class Game:
         self.screen.blit(message_surface, message_rect)
 
     def check_win(self):
+        if self.variant == "ultimate":
+            self.check_ultimate_win()
+            return
+
         for row in range(3):
             if self.board[row][0] == self.board[row][1] == self.board[row][2] and self.board[row][0] is not None:
                 self.winner = self.board[row][0]
@@ -211,6 +288,19 @@ class Game:
         
         self.draw_status()
 
+    def check_ultimate_win(self):
+        if self.state.winner == -1:
+            self.draw = True
+        elif self.state.winner is not None:
+            self.winner = 'x' if self.state.winner == 0 else 'o'
+
+        if self.winner:
+            self.scores[self.winner] += 1
+        elif self.draw:
+            self.scores['draws'] += 1
+
+        self.draw_status()
+
     def draw_xo(self, row, col):
         self.board[row-1][col-1] = self.turn
         posx = (col - 1) * (SCREEN_WIDTH / 3) + 30
@@ -223,7 +313,17 @@ class Game:
             self.turn = 'x'
         pg.display.update()
 
+    def draw_ultimate_xo(self, row, col):
+        self.board[row][col] = self.turn
+        self.state.play(ultimate_move(row, col))
+        self.turn = 'o' if self.turn == 'x' else 'x'
+        self.draw_ultimate_board()
+        pg.display.update()
+
     async def handle_click(self):
+        if self.bot_thinking:
+            return
+
         if "remote" in self.game_mode:
             if not self.is_my_turn:
                 logger.info("Not your turn!")
@@ -232,6 +332,10 @@ class Game:
         x, y = pg.mouse.get_pos()
         if y > SCREEN_HEIGHT: return
 
+        if self.variant == "ultimate":
+            await self.handle_ultimate_click(x, y)
+            return
+
         col = int(x // (SCREEN_WIDTH / 3)) + 1
         row = int(y // (SCREEN_HEIGHT / 3)) + 1
 
@@ -241,7 +345,7 @@ class Game:
 
             if "remote" in self.game_mode:
                 self.is_my_turn = False
-                move_msg = {"type": "make_move", "move": [row-1, col-1]}
+                move_msg = {"type": "make_move", "variant": "classic", "move": [row-1, col-1]}
                 await self.send_message(move_msg)
                 
                 if self.winner or self.draw:
@@ -249,19 +353,81 @@ class Game:
                     await self.send_message(game_over_msg)
             
             elif self.game_mode == 'vs_bot' and not (self.winner or self.draw):
-                agent_board = [[self.mapping[cell] for cell in row] for row in self.board]
-                r, c, _ = self.bot.chooseAction(agent_board, self.mapping[self.turn])
-                await asyncio.sleep(0.25)
-                self.draw_xo(r + 1, c + 1)
-                self.check_win()
+                # Run the bot as a task so run() keeps handling events meanwhile
+                self.start_bot_task(self.bot_move())
+
+    def start_bot_task(self, coro):
+        self.bot_thinking = True
+        self.bot_task = asyncio.create_task(coro)
+        self.bot_task.add_done_callback(self.bot_task_done)
+
+    def bot_task_done(self, task):
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            logger.error(f"Bot move failed: {e!r}")
+
+    def cancel_bot_task(self):
+        if self.bot_task and not self.bot_task.done():
+            logger.info("Cancelling bot move.")
+            self.bot_task.cancel()
+        self.bot_task = None
+        self.bot_thinking = False
+
+    async def bot_move(self):
+        agent_board = [[self.mapping[cell] for cell in row] for row in self.board]
+        deadline = time.monotonic() + BOT_TIME_BUDGET
+        try:
+            # Search in a worker thread so the event loop is not blocked
+            r, c, _ = await asyncio.to_thread(self.bot.chooseAction, agent_board,
+                                              self.mapping[self.turn], deadline, BOT_DIFFICULTY)
+        finally:
+            self.bot_thinking = False
+        self.draw_xo(r + 1, c + 1)
+        self.check_win()
+
+    async def handle_ultimate_click(self, x, y):
+        col = int(x // (SCREEN_WIDTH / 9))
+        row = int(y // (SCREEN_HEIGHT / 9))
+
+        # Only cells of the sub-board the last move sent us to (or any open one) are legal
+        if ultimate_move(row, col) not in self.state.legal_moves():
+            return
+
+        self.draw_ultimate_xo(row, col)
+        self.check_win()
+
+        if "remote" in self.game_mode:
+            self.is_my_turn = False
+            move_msg = {"type": "make_move", "variant": "ultimate", "move": [row, col]}
+            await self.send_message(move_msg)
+
+            if self.winner or self.draw:
+                game_over_msg = {"type": "game_over", "winner": self.winner, "draw": self.draw}
+                await self.send_message(game_over_msg)
+
+        elif self.game_mode == 'vs_bot' and not (self.winner or self.draw):
+            self.start_bot_task(self.ultimate_bot_move())
+
+    async def ultimate_bot_move(self):
+        deadline = time.monotonic() + BOT_TIME_BUDGET
+        try:
+            b, c, _ = await asyncio.to_thread(self.ultimate_bot.chooseAction, self.state.copy(),
+                                              deadline, BOT_DIFFICULTY)
+        finally:
+            self.bot_thinking = False
+        self.draw_ultimate_xo(*ultimate_cell(b, c))
+        self.check_win()
 
     def reset_game(self):
         logger.info("Resetting game board.")
+        self.cancel_bot_task()
         time.sleep(.1)
         self.turn = 'x'
         self.draw = False
         self.winner = None
-        self.board = [[None] * 3, [None] * 3, [None] * 3]
+        self.board = self.new_board()
         self.draw_board()
 
     # --- ASYNCIO NETWORKING FUNCTIONS ---
@@ -285,9 +451,18 @@ class Game:
         msg_type = msg.get('type')
 
         if msg_type == 'make_move':
-            if not self.is_my_turn:
+            variant = msg.get('variant', 'classic')
+            if variant != self.variant:
+                logger.warning(f"Ignoring move for the {variant} variant.")
+            elif not self.is_my_turn:
                 r, c = msg['move']
-                self.draw_xo(r + 1, c + 1)
+                if self.variant == "ultimate":
+                    if ultimate_move(r, c) not in self.state.legal_moves():
+                        logger.warning(f"Ignoring illegal move: {msg['move']}")
+                        return
+                    self.draw_ultimate_xo(r, c)
+                else:
+                    self.draw_xo(r + 1, c + 1)
                 self.check_win()
                 self.is_my_turn = True
         
@@ -297,6 +472,11 @@ class Game:
             self.is_my_turn = False
             self.draw_status()
         
+        elif msg_type == 'setup':
+            # The host decides which variant is played
+            self.variant = msg.get('variant', 'classic')
+            self.reset_game()
+
         elif msg_type == 'reset':
             self.reset_game()
             self.is_my_turn = (self.player_char == 'x')
@@ -332,6 +512,7 @@ class Game:
         self.player_char = 'x'
         self.is_my_turn = True
         self.draw_board()
+        await self.send_message({"type": "setup", "variant": self.variant})
         
         self.network_task = asyncio.create_task(self.network_listen_loop())
         await self.network_task
@@ -433,6 +614,11 @@ class Game:
                                 self.input_text = "127.0.0.1" # Default host
                                 self.game_state = "GET_HOST_INPUT"
 
+                            elif self.variant_rect.collidepoint(event.pos):
+                                self.variant = "ultimate" if self.variant == "classic" else "classic"
+                                logger.info(f"Menu: Switched to '{self.variant}' mode")
+                                self.board = self.new_board()
+
                     # --- State: LOCAL_MENU ---
                     elif self.game_state == "LOCAL_MENU":
                         if event.type == pg.MOUSEBUTTONDOWN:
@@ -518,6 +704,7 @@ class Game:
             logger.info("Main game loop cancelled.")
         finally:
             logger.info("Main loop finished. Running cleanup...")
+            self.cancel_bot_task()
             await self.close_connection()
             pg.quit()
             logger.info("Pygame quit. Exiting.")
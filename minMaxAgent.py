@@ -1,167 +1,232 @@
 import math
+import time
 import logging
 
+from endgameDatabase import DRAW, WIN, LOSS, RESULT_NAMES
+
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
 
+# Score of a won position; wins found closer to the root score higher
+WIN_SCORE = 1000
+
+# Maximum search depth (in plies) for each difficulty, None means unbounded
+DIFFICULTY_DEPTH = {'easy': 1, 'medium': 3, 'hard': None}
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search once its deadline has passed."""
+    pass
+
+
+# Preference of each database result of the position left to the opponent
+DATABASE_RANK = {LOSS: 2, DRAW: 1, WIN: 0}
+
 
 class MinMaxAgent:
-    def __init__(self, mem=None):
+    def __init__(self, mem=None, db=None):
+        # Only completed depth-limited searches are cached: the deadline is left
+        # out of the key and a search that times out raises before it is stored
         if mem is not None:
-            self._chooseAction = mem.cache(self._chooseAction)
+            self._searchRoot = mem.cache(self._searchRoot, ignore=['deadline'])
         else:
-            self._chooseAction = self._chooseAction
+            self._searchRoot = self._searchRoot
+        # Optional EndgameDatabase consulted before searching
+        self.db = db
 
     @staticmethod
-    def _isMovesLeft(board) :  
+    def _available_positions(board):
+        positions = []
         for i in range(len(board)):
             for j in range(len(board[0])):
-                if (board[i][j] == 0) : 
-                    return True 
-        return False
-
-    @staticmethod
-    def _available_positions(current_state):
-        positions = []
-        for i in range(len(current_state)):
-            if current_state[i] == 0:
-                r = int(i / self.cols)
-                c = i % self.cols
-                positions.append((r, c))
+                if board[i][j] == 0:
+                    positions.append((i, j))
         return positions
 
     @staticmethod
     def _evaluate(board, player):
         opponent = -player
-        # Checking for Rows for X or O victory.  
-        for row in range(len(board)):      
-            if (board[row][0] == board[row][1] and board[row][1] == board[row][2]):         
-                if (board[row][0] == player) : 
-                    return 10
-                elif (board[row][0] == opponent) : 
-                    return -10
-
-        # Checking for Columns for X or O victory.  
-        for col in range(len(board[0])): 
-            if (board[0][col] == board[1][col] and board[1][col] == board[2][col]): 
-                if (board[0][col] == player):  
-                    return 10
-                elif (board[0][col] == opponent): 
-                    return -10
-
-        # Checking for Diagonals for X or O victory.  
-        if (board[0][0] == board[1][1] and board[1][1] == board[2][2]): 
-            if (board[0][0] == player) : 
-                return 10
-            elif (board[0][0] == opponent) : 
-                return -10
-
-        if (board[0][2] == board[1][1] and board[1][1] == board[2][0]): 
-            if (board[0][2] == player): 
-                return 10
-            elif (board[0][2] == opponent): 
-                return -10
+        n = len(board)
+        lines = [board[row] for row in range(n)]
+        lines += [[board[row][col] for row in range(n)] for col in range(n)]
+        lines.append([board[i][i] for i in range(n)])
+        lines.append([board[i][n - 1 - i] for i in range(n)])
+
+        # Checking Rows, Columns and Diagonals for X or O victory.
+        for line in lines:
+            if line[0] != 0 and line.count(line[0]) == n:
+                if line[0] == player:
+                    return WIN_SCORE
+                elif line[0] == opponent:
+                    return -WIN_SCORE
 
         # Else if none of them have won then return 0  
         return 0
 
     @staticmethod
-    def _minimax(board, player , depth, isMax, alpha, beta):
+    def _minimax(board, player , depth, isMax, alpha, beta, max_depth=None, deadline=None):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise SearchTimeout()
+
         score = MinMaxAgent._evaluate(board, player)
         opponent = -player
 
         # If Maximizer has won the game return his/her  
-        # evaluated score  
-        if (score == 10):
-            return score 
+        # evaluated score (prefer the quickest win)
+        if (score == WIN_SCORE):
+            return score - depth
 
         # If Minimizer has won the game return his/her  
-        # evaluated score  
-        if (score == -10):
-            return score 
+        # evaluated score (prefer the slowest loss)
+        if (score == -WIN_SCORE):
+            return score + depth
+
+        moves = MinMaxAgent._available_positions(board)
 
         # If there are no more moves and no winner then  
         # it is a tie  
-        if (MinMaxAgent._isMovesLeft(board) == False):
+        if not moves:
+            return 0
+
+        # Search horizon reached, the position is unresolved
+        if max_depth is not None and depth >= max_depth:
             return 0
 
         # If this maximizer's move  
         if (isMax) :      
             best = -math.inf
-            # Traverse all cells  
-            for i in range(len(board)):
-                for j in range(len(board[0])):
-                    # Check if cell is empty  
-                    if (board[i][j]==0): 
-                        # Make the move
-                        board[i][j] = player
-                        # Call minimax recursively and choose
-                        eval_score = MinMaxAgent._minimax(board, player, depth + 1, not isMax, alpha, beta)
-                        # the maximum value  
-                        best = max(best, eval_score)
-                        # Undo the move  
-                        board[i][j] = 0
-                        alpha = max(alpha, eval_score)
-                        if beta <= alpha:
-                            break
+            for i, j in moves:
+                # Make the move
+                board[i][j] = player
+                try:
+                    # Call minimax recursively and choose
+                    eval_score = MinMaxAgent._minimax(board, player, depth + 1, not isMax, alpha, beta, max_depth, deadline)
+                finally:
+                    # Undo the move  
+                    board[i][j] = 0
+                # the maximum value
+                best = max(best, eval_score)
+                alpha = max(alpha, eval_score)
+                if beta <= alpha:
+                    break
             return best 
 
         # If this minimizer's move  
         else : 
             best = math.inf
-            # Traverse all cells  
-            for i in range(len(board)):
-                for j in range(len(board[0])):
-                    # Check if cell is empty  
-                    if (board[i][j] == 0):
-                        # Make the move  
-                        board[i][j] = opponent  
-                        # Call minimax recursively and choose
-                        eval_score = MinMaxAgent._minimax(board, player, depth + 1, not isMax, alpha, beta)
-                        # the minimum value  
-                        best = min(best, eval_score) 
-                        # Undo the move  
-                        board[i][j] = 0
-                        beta = min(beta, eval_score)
-                        if beta <= alpha:
-                            break
-            return best
-
-    @staticmethod
-    def _chooseAction(current_state, symbol):
-        board = current_state
-        bestVal = -1000 
-        bestMove = (-1, -1)
-
-        #logger.info(f'{board}')
-
-        for i in range(len(board)):
-            for j in range(len(board)):
-                # Check if cell is empty  
-                if (board[i][j] == 0) :  
-
-                    # Make the move  
-                    board[i][j] = symbol 
-
-                    # compute evaluation function for this  move.
-                    #key = ''.join(board.flatten().astype(int).astype(str)) + str(symbol)
-                    #if key in self.table:
-                    #    moveVal = self.table[key]
-                    #else:
-                    moveVal = MinMaxAgent._minimax(board, symbol, 0, False, -math.inf, math.inf)
-                        #self.table[key] = moveVal
-
+            for i, j in moves:
+                # Make the move
+                board[i][j] = opponent
+                try:
+                    # Call minimax recursively and choose
+                    eval_score = MinMaxAgent._minimax(board, player, depth + 1, not isMax, alpha, beta, max_depth, deadline)
+                finally:
                     # Undo the move  
                     board[i][j] = 0
+                # the minimum value
+                best = min(best, eval_score)
+                beta = min(beta, eval_score)
+                if beta <= alpha:
+                    break
+            return best 
 
-                    if (moveVal > bestVal) :                 
-                        bestMove = (i, j) 
-                        bestVal = moveVal
+    @staticmethod
+    def _searchRoot(board, symbol, moves, max_depth, deadline):
+        bestVal = -math.inf
+        bestMove = moves[0]
+        scores = {}
+
+        for i, j in moves:
+            # Make the move
+            board[i][j] = symbol
+            try:
+                # compute evaluation function for this move.
+                moveVal = MinMaxAgent._minimax(board, symbol, 1, False, bestVal, math.inf, max_depth, deadline)
+            finally:
+                # Undo the move
+                board[i][j] = 0
+
+            scores[(i, j)] = moveVal
+            if (moveVal > bestVal) :
+                bestMove = (i, j)
+                bestVal = moveVal
+
+        return bestMove, bestVal, scores
+
+    def _chooseAction(self, current_state, symbol, deadline=None, difficulty='hard'):
+        board = [list(row) for row in current_state]
+        moves = MinMaxAgent._available_positions(board)
+        if not moves:
+            return -1, -1, []
+
+        max_depth = DIFFICULTY_DEPTH[difficulty]
+        # The game cannot last longer than the number of empty cells
+        limit = len(moves) if max_depth is None else min(max_depth, len(moves))
+
+        bestMove = moves[0]
+        report = []
+        start = time.monotonic()
+
+        # Iterative deepening: each completed iteration replaces the best
+        # move and orders the root moves for the next, deeper one.
+        for depth in range(1, limit + 1):
+            try:
+                move, value, scores = self._searchRoot(board, symbol, moves, depth, deadline)
+            except SearchTimeout:
+                logger.info(f'Depth {depth}: aborted at deadline ({time.monotonic() - start:.3f}s)')
+                break
+
+            bestMove = move
+            elapsed = time.monotonic() - start
+            report.append({'depth': depth, 'move': move, 'score': value, 'time': elapsed})
+            logger.info(f'Depth {depth}: move {move} score {value} ({elapsed:.3f}s)')
+
+            # A forced result was found, deeper searches cannot change it
+            if abs(value) >= WIN_SCORE - depth:
+                break
+
+            moves = sorted(moves, key=lambda m: scores[m], reverse=True)
 
         r, c = bestMove
-        return r, c, None
-
-    def chooseAction(self, current_state, symbol):
-        return self._chooseAction(current_state, symbol)
+        return r, c, report
+
+    def _databaseAction(self, current_state, symbol):
+        n = len(current_state)
+        # The agent plays n-in-a-row on square boards
+        if (self.db.rows, self.db.cols, self.db.k) != (n, len(current_state[0]), n):
+            return None
+
+        board = [list(row) for row in current_state]
+        bestRank = -1
+        bestMove = None
+        bestResult = None
+
+        for i, j in MinMaxAgent._available_positions(board):
+            board[i][j] = symbol
+            result = self.db.lookup(board, -symbol)
+            # Prefer winning right away over a slower forced win
+            won = MinMaxAgent._evaluate(board, symbol) == WIN_SCORE
+            board[i][j] = 0
+
+            if result is None:
+                return None
+            rank = 3 if won else DATABASE_RANK[result]
+            if rank > bestRank:
+                bestRank = rank
+                bestMove = (i, j)
+                bestResult = result
+
+        if bestMove is not None:
+            logger.info(f'Database: move {bestMove} leaves the opponent a {RESULT_NAMES[bestResult]}')
+        return bestMove
+
+    def chooseAction(self, current_state, symbol, deadline=None, difficulty='hard'):
+        # Perfect play straight from the endgame database when it covers the board
+        if self.db is not None and difficulty == 'hard':
+            move = self._databaseAction(current_state, symbol)
+            if move is not None:
+                r, c = move
+                return r, c, []
+        return self._chooseAction(current_state, symbol, deadline, difficulty)
@@ -0,0 +1,246 @@
+import math
+import time
+import logging
+
+from minMaxAgent import DIFFICULTY_DEPTH, SearchTimeout
+
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Score of a won game; wins found closer to the root score higher
+WIN_SCORE = 100000
+
+# The deadline is checked every CHECK_NODES nodes (must be a power of two)
+CHECK_NODES = 1024
+
+# Cells (and sub-boards) are numbered 0..8 row by row; a 3x3 board is a 9-bit mask
+FULL = 0x1FF
+LINES = (0b000000111, 0b000111000, 0b111000000,
+         0b001001001, 0b010010010, 0b100100100,
+         0b100010001, 0b001010100)
+
+# WIN_TABLE[mask] is True when the mask contains a complete line
+WIN_TABLE = tuple(any(mask & line == line for line in LINES) for mask in range(FULL + 1))
+
+# EMPTY_CELLS[occupied] lists the free cells of a 3x3 board
+EMPTY_CELLS = tuple(tuple(c for c in range(9) if not occupied >> c & 1) for occupied in range(FULL + 1))
+
+# BOARD_MOVES[b][occupied] lists the moves (b * 9 + cell) still available in sub-board b
+BOARD_MOVES = tuple(tuple(tuple(b * 9 + c for c in EMPTY_CELLS[occupied]) for occupied in range(FULL + 1))
+                    for b in range(9))
+
+
+def _lineScore(mine, theirs):
+    score = 0
+    for line in LINES:
+        if theirs & line == 0:
+            n = bin(mine & line).count('1')
+            score += (0, 1, 4, 0)[n]
+    return score
+
+
+def _lineTables():
+    """Line scores for every pair of disjoint masks, keyed by mine << 9 | theirs."""
+    scores = {}
+    for mine in range(FULL + 1):
+        # Only enumerate the subsets of the cells mine leaves free
+        free = FULL ^ mine
+        theirs = free
+        while True:
+            scores[mine << 9 | theirs] = _lineScore(mine, theirs)
+            if theirs == 0:
+                break
+            theirs = (theirs - 1) & free
+    evals = {key: score - scores[(key & FULL) << 9 | key >> 9] for key, score in scores.items()}
+    return scores, evals
+
+
+# LINE_SCORE[mine << 9 | theirs] rates the lines still open for mine on a 3x3 board,
+# LINE_EVAL[mine << 9 | theirs] weighs them against the ones still open for theirs
+LINE_SCORE, LINE_EVAL = _lineTables()
+
+
+class UltimateState:
+    """Ultimate tic-tac-toe position stored as one bitboard per sub-board and player.
+
+    Players are indexed 0 (x, symbol 1) and 1 (o, symbol -1). A move is the integer
+    board * 9 + cell, where both board and cell are numbered 0..8 row by row.
+    """
+
+    __slots__ = ('boards', 'macro', 'closed', 'target', 'player', 'winner', 'history')
+
+    def __init__(self):
+        self.boards = ([0] * 9, [0] * 9)
+        # Sub-boards won by each player
+        self.macro = [0, 0]
+        # Sub-boards that are won or full and accept no more moves
+        self.closed = 0
+        # Sub-board the next move must be played in, -1 means any open board
+        self.target = -1
+        self.player = 0
+        # None while playing, 0 or 1 for a win, -1 for a draw
+        self.winner = None
+        self.history = []
+
+    def copy(self):
+        state = UltimateState()
+        state.boards = (self.boards[0][:], self.boards[1][:])
+        state.macro = self.macro[:]
+        state.closed = self.closed
+        state.target = self.target
+        state.player = self.player
+        state.winner = self.winner
+        return state
+
+    def legal_moves(self):
+        if self.winner is not None:
+            return []
+        boards = self.boards
+        if self.target >= 0:
+            b = self.target
+            return BOARD_MOVES[b][boards[0][b] | boards[1][b]]
+        moves = []
+        for b in EMPTY_CELLS[self.closed]:
+            moves.extend(BOARD_MOVES[b][boards[0][b] | boards[1][b]])
+        return moves
+
+    def play(self, move):
+        b, c = divmod(move, 9)
+        p = self.player
+        mine = self.boards[p]
+        self.history.append((move, self.target, self.closed, self.macro[p], self.winner))
+
+        bits = mine[b] | (1 << c)
+        mine[b] = bits
+        if WIN_TABLE[bits]:
+            self.macro[p] |= 1 << b
+            self.closed |= 1 << b
+            if WIN_TABLE[self.macro[p]]:
+                self.winner = p
+        elif bits | self.boards[1 - p][b] == FULL:
+            self.closed |= 1 << b
+        if self.winner is None and self.closed == FULL:
+            self.winner = -1
+
+        # The opponent is sent to the sub-board matching the played cell
+        self.target = -1 if self.closed >> c & 1 else c
+        self.player = 1 - p
+
+    def undo(self):
+        move, self.target, self.closed, macro, self.winner = self.history.pop()
+        b, c = divmod(move, 9)
+        p = 1 - self.player
+        self.player = p
+        self.macro[p] = macro
+        self.boards[p][b] &= ~(1 << c)
+
+    def evaluate(self):
+        """Heuristic score of a running game from the side to move's point of view."""
+        p = self.player
+        mine, theirs = self.boards[p], self.boards[1 - p]
+        macro_mine, macro_theirs = self.macro[p], self.macro[1 - p]
+        # Drawn sub-boards block macro lines for both players
+        drawn = self.closed & ~(macro_mine | macro_theirs)
+
+        score = 16 * (LINE_SCORE[macro_mine << 9 | macro_theirs | drawn]
+                      - LINE_SCORE[macro_theirs << 9 | macro_mine | drawn])
+        for b in EMPTY_CELLS[self.closed]:
+            score += LINE_EVAL[mine[b] << 9 | theirs[b]]
+        return score
+
+
+class UltimateAgent:
+    def __init__(self):
+        self.nodes = 0
+        self.deadline = None
+
+    def _negamax(self, state, depth, ply, alpha, beta):
+        self.nodes += 1
+        if self.nodes & (CHECK_NODES - 1) == 0 and self.deadline is not None \
+                and time.monotonic() >= self.deadline:
+            raise SearchTimeout()
+
+        winner = state.winner
+        if winner is not None:
+            # The previous move ended the game, so only a loss or a draw is possible
+            return 0 if winner == -1 else ply - WIN_SCORE
+        if depth == 0:
+            return state.evaluate()
+
+        best = -math.inf
+        for move in state.legal_moves():
+            state.play(move)
+            try:
+                score = -self._negamax(state, depth - 1, ply + 1, -beta, -alpha)
+            finally:
+                state.undo()
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+    def _searchRoot(self, state, moves, depth):
+        bestVal = -math.inf
+        bestMove = moves[0]
+        scores = {}
+
+        for move in moves:
+            state.play(move)
+            try:
+                moveVal = -self._negamax(state, depth - 1, 1, -math.inf, -bestVal)
+            finally:
+                state.undo()
+
+            scores[move] = moveVal
+            if moveVal > bestVal:
+                bestMove = move
+                bestVal = moveVal
+
+        return bestMove, bestVal, scores
+
+    def chooseAction(self, state, deadline=None, difficulty='hard'):
+        """Returns the (board, cell) to play for the side to move and the per-depth report."""
+        state = state.copy()
+        moves = list(state.legal_moves())
+        if not moves:
+            return -1, -1, []
+
+        max_depth = DIFFICULTY_DEPTH[difficulty]
+        limit = 81 if max_depth is None else max_depth
+
+        self.nodes = 0
+        self.deadline = deadline
+        bestMove = moves[0]
+        report = []
+        start = time.monotonic()
+
+        # Iterative deepening, as in MinMaxAgent: keep the last completed
+        # iteration and use its scores to order the root moves.
+        for depth in range(1, limit + 1):
+            try:
+                move, value, scores = self._searchRoot(state, moves, depth)
+            except SearchTimeout:
+                logger.info(f'Depth {depth}: aborted at deadline ({time.monotonic() - start:.3f}s)')
+                break
+
+            bestMove = move
+            elapsed = time.monotonic() - start
+            nps = self.nodes / elapsed if elapsed > 0 else 0
+            report.append({'depth': depth, 'move': divmod(move, 9), 'score': value,
+                           'time': elapsed, 'nodes': self.nodes, 'nps': nps})
+            logger.info(f'Depth {depth}: move {divmod(move, 9)} score {value} '
+                        f'({elapsed:.3f}s, {self.nodes} nodes, {nps:.0f} nps)')
+
+            # A forced result was found, deeper searches cannot change it
+            if abs(value) >= WIN_SCORE - depth:
+                break
+
+            moves.sort(key=lambda m: scores[m], reverse=True)
+
+        b, c = divmod(bestMove, 9)
+        return b, c, report